@@ -1,5 +1,6 @@
 from datetime import date
 import pytest
+import todotxt
 from todotxt import *  # noqa
 
 
@@ -30,11 +31,38 @@ def test_two_projects():
     assert not task.priority
 
 
+def test_contexts_follow_modifications():
+    task = Task('do something @context2 @context1 @context2')
+    assert task.contexts == ['context1', 'context2']
+    task -= TaskContext('context2')
+    assert task.contexts == ['context1', 'context2']
+    assert task in TaskContext.index['context2']
+    task -= TaskContext('context2')
+    assert task.contexts == ['context1']
+    task += TaskContext('context0')
+    assert task.contexts == ['context0', 'context1']
+
+
+def test_tokens_before_a_line_break():
+    task = Task('call mom @phone due:2000-01-01\n')
+    assert task.due_date == datetime.date(2000, 1, 1)
+    task = Task('call mom @phone\n')
+    assert task.contexts == ['phone']
+    assert task == 'call mom @phone'
+    assert Task('call mom\t\n') == 'call mom'
+
+
 def test_project_with_dot_and_dash():
     task = Task('write docs for a +todo.txt-pylib')
     assert task.projects == ['todo.txt-pylib']
 
 
+def test_value_groups_and_flags_within_the_tokenizer():
+    task = Task('mail @@home about HTTP://GINATRAPANI.ORG')
+    assert task.contexts == ['@home']
+    assert isinstance(task.tokens[-1], Url)
+
+
 def test_single_plus():
     task = Task('this task has a + in the middle')
     assert task == 'this task has a + in the middle'
@@ -67,6 +95,10 @@ def test_completed_task():
     assert task.completion_date.value == datetime.date(2000, 1, 1)
     task.is_completed = False
     assert task == 'finalize millenium'
+    assert task.html == '<div class="task">finalize millenium</div>'
+    task.is_completed = True
+    assert str(task).startswith('x {} '.format(datetime.date.today().isoformat()))
+    assert task.html.startswith('<div class="task completed">x <span class="completeddate">')
 
 
 def test_dates():
@@ -90,6 +122,52 @@ def test_dates():
     task.due_date = '2000-12-31'
     task.threshold_date = datetime.date(2000, 1, 1)
     assert task == 'a task due:2000-12-31 t:2000-01-01'
+    assert task in Task.overdue_tasks()
+    task -= TaskDueDate
+    assert task not in Task.overdue_tasks()
+    assert task.due_date is None
+    task.threshold_date = datetime.date(2000, 1, 2)
+    assert task.threshold_date == datetime.date(2000, 1, 2)
+    assert str(TaskDueDate(datetime.datetime(2000, 1, 2, 3, 4))) == 'due:2000-01-02'
+
+
+def test_dates_consist_of_ascii_digits():
+    task = Task('2000-01-01 call due:\uff12\uff10\uff10\uff10-\uff10\uff11-\uff10\uff11')
+    assert task.created_date.value == datetime.date(2000, 1, 1)
+    assert task.due_date is None
+    assert isinstance(task.tokens[-1], TaskString)
+
+
+def test_date_queries_match_properties():
+    task = Task('d due:2000-01-01 due:2999-01-01 t:2999-01-01 t:2000-01-01')
+    assert task.is_overdue and task in Task.overdue_tasks()
+    assert task.is_on_threshold and task in Task.future_tasks()
+    task = Task('d due:2999-01-01 due:2000-01-01 t:2000-01-01 t:2999-01-01')
+    assert not task.is_overdue and task not in Task.overdue_tasks()
+    assert not task.is_on_threshold and task not in Task.future_tasks()
+    task = Task('d')
+    task.due_date = datetime.datetime(2000, 1, 1, 5)
+    task.threshold_date = datetime.datetime(2999, 1, 1, 5)
+    assert task.is_overdue and task in Task.overdue_tasks()
+    assert task.is_on_threshold and task in Task.future_tasks()
+
+
+def test_today_batch():
+    task = Task('overdue due:1999-12-31')
+    with Task.today_batch() as today:
+        assert today == date.today()
+        with Task.today_batch() as inner_today:
+            assert inner_today is today
+            assert task.is_overdue
+        assert task in Task.all_tasks().filter(is_overdue=True)
+
+
+def test_prefix_only_lines():
+    assert Task('x').is_completed
+    assert Task('x 2000-01-01').completion_date == datetime.date(2000, 1, 1)
+    assert Task('x (A)').priority == 1
+    assert Task('(B)') == '(B)'
+    assert Task('2000-01-01').created_date == datetime.date(2000, 1, 1)
 
 
 def test_task_creation_date():
@@ -101,6 +179,11 @@ def test_date_tokens():
     date1 = TaskDueDate('0001-02-03')
     date2 = TaskCreatedDate(date1)
     assert date1.value == date2.value
+    assert TaskThresholdDate('t:0001-02-03').value == TaskDueDate('due:0001-02-03').value == date1.value
+    for token_type, string in ((TaskThresholdDate, 'due:0001-02-03'), (TaskCreatedDate, 't:0001-02-03'),
+                               (TaskDueDate, '0001-13-03')):
+        with pytest.raises(ValueError):
+            token_type(string)
 
 
 def test_valid_priority():
@@ -188,6 +271,8 @@ def test_priority_token():
         TaskPriority('abc')
     with pytest.raises(ValueError):
         TaskPriority('ß')
+    with pytest.raises(ValueError):
+        TaskPriority('@')
     with pytest.raises(ValueError):
         TaskPriority(29)
 
@@ -197,6 +282,15 @@ def test_token_in_task():
     assert '@context' in task
     assert TaskContext('context') in task
     assert 'A task' in task
+    assert TaskContext in task
+    assert TaskProject not in task
+    assert TaskProject('project') not in task
+    assert TaskProject('context') not in task
+    assert TaskContext('task') not in task
+    assert TaskPriority(0) in task
+    assert TaskPriority('A') not in task
+    assert TaskPriority not in Task('plain')
+    assert TaskPriority in Task('(A) prioritized')
 
 
 def test_operators():
@@ -275,9 +369,23 @@ def test_operators():
 
     with pytest.raises(ValueError):
         task.__iadd__(date(2000, 1, 1))
+    with pytest.raises(ValueError):
+        task.__iadd__(['@ghost', date(2000, 1, 1)])
+    assert task == 'x (A) @context Hello world!'
+    assert task.contexts == ['context']
+    assert task not in Task.all_tasks().filter(context='ghost')
 
     with pytest.raises(ValueError):
         task.__isub__(['@context', date(2000, 1, 1)])
+    assert task == 'x (A) @context Hello world!'
+    with pytest.raises(ValueError, match='^BaseDateToken is not supported'):
+        task.__isub__(BaseDateToken)
+    with pytest.raises(ValueError):
+        task.__isub__(TaskContext)
+
+    task += '@context @context +project'
+    task -= ['@context', '+project', '@context']
+    assert task == 'x (A) Hello world! @context'
 
 
 def test_invalid_value():
@@ -306,6 +414,18 @@ def test_comparison():
     assert Task('do something +project1 @context1') > Task('(A) do something else +project1 @context2')
     assert Task('something else +project1 @context2') > Task('(A) do something else +project1 @context2')
 
+    assert Task('task due:2000-01-01') < Task('task due:2000-01-02') < Task('task')
+    assert Task('task') < Task('task t:2000-01-01')
+    assert not Task('task') < Task('task') and not Task('task') > Task('task')
+
+    task1, task2 = Task('task'), Task('task')
+    task1.due_date = datetime.datetime(2000, 1, 1, 5)
+    task2.threshold_date = datetime.datetime(2000, 1, 1, 5)
+    assert Task('task due:2000-01-01') == task1 < Task('task due:2000-01-02')
+    assert sorted([task2, Task('task'), task1]) == [task1, Task('task'), task2]
+    assert TaskManager([task2, task1]).list == [task1, task2]
+    assert Task('task t:1999-12-31') < task2 < Task('task t:2000-01-02')
+
 
 def test_indexes():
     task = Task('(A) something +todo @work due:2002-02-20')
@@ -346,6 +466,7 @@ def test_html():
         ('https://github.com/mNantern/QTodoTxt/archive/master.zip',
          '<div class="task"><a href="https://github.com/mNantern/QTodoTxt/archive/master.zip">'
          'https://github.com/mNantern/QTodoTxt/archive/master.zip</a></div>'),
+        ('FILE:///etc/hosts', '<div class="task"><a href="FILE:///etc/hosts">FILE:///etc/hosts</a></div>'),
         ('http://ginatrapani.org',
          '<div class="task"><a href="http://ginatrapani.org">http://ginatrapani.org</a></div>'),
         ('http://ginatrapani.org/', '<div class="task"><a href="http://ginatrapani.org/">http://ginatrapani.org/</a>'
@@ -365,6 +486,12 @@ def test_html():
         Task.html_context_class_mapping = {}
 
 
+def unregister(token_type):
+    """ Keeps a token type that a test defines from classifying the words of later tests. """
+    unambiguous_token_types.discard(token_type)
+    todotxt._reset_tokenizer()
+
+
 def test_custom_token():
     class BoldToken(BaseToken):
         html_pattern = '<strong>{name}</strong>'
@@ -372,10 +499,202 @@ def test_custom_token():
         str_pattern = '**{name}**'
         type = str
 
-    assert BoldToken in token_types
-    assert BoldToken not in fixed_token_types
-    assert BoldToken in unambiguous_token_types
-    assert Task('add **Markdown** flavor').html == '<div class="task">add <strong>Markdown</strong> flavor</div>'
+    try:
+        assert BoldToken in token_types
+        assert BoldToken not in fixed_token_types
+        assert BoldToken in unambiguous_token_types
+        assert Task('add **Markdown** flavor').html == '<div class="task">add <strong>Markdown</strong> flavor</div>'
+    finally:
+        unregister(BoldToken)
+    assert isinstance(Task('add **Markdown** flavor').tokens[-2], TaskString)
+
+
+def test_custom_token_without_anchors():
+    class IssueToken(BaseToken):
+        html_pattern = '<em>{name}</em>'
+        parse_pattern = r'(?P<value>\S+/\S+#\d+)'
+        str_pattern = '{name}'
+        type = str
+
+    try:
+        task = Task('solve funkyfuture/todo.txt-pylib#1 and funkyfuture/todo.txt-pylib#2, please')
+        assert task == 'solve funkyfuture/todo.txt-pylib#1 and funkyfuture/todo.txt-pylib#2, please'
+        assert isinstance(task.tokens[5], IssueToken)
+        assert isinstance(task.tokens[7], TaskString)
+    finally:
+        unregister(IssueToken)
+
+
+def test_custom_token_with_custom_duck():
+    class EstimateToken(BaseToken):
+        html_pattern = '<span class="estimate">~{name}h</span>'
+        parse_pattern = r'^~(?P<value>\d+)h$'
+        str_pattern = '~{name}h'
+        type = (str, int)
+
+        @classmethod
+        def _duck(cls, value):
+            if isinstance(value, str):
+                value = int(cls.parse_pattern.match(value).group('value'))
+            return value
+
+    try:
+        task = Task('refactor the parser ~3h')
+        assert task.tokens[-1].value == EstimateToken('~3h', None).value == 3
+        assert task == 'refactor the parser ~3h'
+    finally:
+        unregister(EstimateToken)
+
+
+def test_custom_token_with_flags():
+    class HashtagToken(BaseToken):
+        html_pattern = '<span class="hashtag">#{name}</span>'
+        parse_pattern = re.compile(r'^#(?P<value>\w+)$', re.ASCII)
+        str_pattern = '#{name}'
+        type = str
+
+    try:
+        task = Task('visit the #cafe or the #café')
+        assert isinstance(task.tokens[-4], HashtagToken)
+        assert isinstance(task.tokens[-1], TaskString)
+    finally:
+        unregister(HashtagToken)
+
+
+def test_custom_token_with_numbered_backreference():
+    class ShoutToken(BaseToken):
+        html_pattern = '<strong>{name}</strong>'
+        parse_pattern = r'^(?P<value>(\w)\2+)!$'
+        str_pattern = '{name}!'
+        type = str
+
+    try:
+        task = Task('say aaa! and ab! @home')
+        assert task.tokens[5].value == 'aaa'
+        assert isinstance(task.tokens[7], TaskString)
+        assert task.contexts == ['home']
+    finally:
+        unregister(ShoutToken)
+
+
+def test_singleton_filters_match_properties():
+    task1 = Task('(A) fix (B) bug')
+    task2 = Task('d due:2000-01-01 due:2999-01-01')
+    assert task1.priority.value == 1
+    assert task1 in Task.all_tasks().filter(priority=1)
+    assert task1 not in Task.all_tasks().filter(priority=2)
+    assert task2 in Task.all_tasks().filter(due_date=date(2000, 1, 1))
+    assert task2 not in Task.all_tasks().filter(due_date=date(2999, 1, 1))
+    task2 -= TaskDueDate
+    assert task2.due_date == date(2999, 1, 1)
+    assert task2 in Task.all_tasks().filter(due_date=date(2999, 1, 1))
+
+
+def test_filters_match_reassigned_values():
+    task = Task('(A) foo due:2000-01-01 @home')
+    task.priority.value = 3
+    assert task in Task.all_tasks().filter(priority=3)
+    assert task not in Task.all_tasks().filter(priority=1)
+    task.due_date.value = date(2000, 1, 2)
+    assert task in Task.all_tasks().filter(due_date=date(2000, 1, 2))
+    assert task not in Task.all_tasks().filter(due_date=date(2000, 1, 1))
+    task.tokens[-1].value = 'office'
+    assert task in Task.all_tasks().filter(context='office')
+    assert task not in Task.all_tasks().filter(context='home')
+
+
+def test_removing_an_absent_singleton_doesnt_index():
+    task = Task('other')
+    task -= 'due:2000-01-01'
+    assert task.due_date is None
+    assert task not in Task.overdue_tasks()
+    assert task not in Task.all_tasks().filter(due_date=date(2000, 1, 1))
+
+
+def test_reassigned_html_pattern():
+    task = Task('call @home')
+    assert task.html == '<div class="task">call <span class="context">@home</span></div>'
+    html_pattern = TaskContext.html_pattern
+    try:
+        TaskContext.html_pattern = '<b>@{name}</b>'
+        assert task.html == '<div class="task">call <b>@home</b></div>'
+    finally:
+        TaskContext.html_pattern = html_pattern
+
+
+def test_reassigned_str_pattern():
+    token = TaskContext('home')
+    task = Task('call @home')
+    assert str(token) == '@home'
+    assert str(task) == 'call @home'
+    str_pattern = TaskContext.str_pattern
+    try:
+        TaskContext.str_pattern = '@{name}!'
+        assert str(token) == '@home!'
+        assert str(task) == 'call @home!'
+    finally:
+        TaskContext.str_pattern = str_pattern
+    assert str(task) == 'call @home'
+
+
+def test_reassigned_token_value():
+    task = Task('pay the rent due:2000-01-01')
+    assert str(task) == 'pay the rent due:2000-01-01'
+    assert task.html == '<div class="task overdue">pay the rent <span class="duedate">due:2000-01-01</span></div>'
+    assert task in Task.overdue_tasks()
+    task.due_date.value = date(2999, 1, 1)
+    assert str(task.due_date) == 'due:2999-01-01'
+    assert str(task) == 'pay the rent due:2999-01-01'
+    assert task.html == '<div class="task">pay the rent <span class="duedate">due:2999-01-01</span></div>'
+    assert not task.is_overdue and task not in Task.overdue_tasks()
+    task = Task('later t:2000-01-01')
+    assert task not in Task.future_tasks() and task in Task.active_tasks()
+    task.threshold_date.value = date(2999, 1, 1)
+    assert task.is_on_threshold and task in Task.future_tasks()
+    assert task not in Task.active_tasks()
+    token = TaskProject('home')
+    assert str(token) == '+home'
+    assert token.html == '<span class="project">+home</span>'
+    token.value = 'garden'
+    assert str(token) == '+garden'
+    assert token.html == '<span class="project">+garden</span>'
+
+
+def test_reassigned_token_value_is_indexed():
+    task = Task('water @garden @garden @kitchen')
+    task.tokens[5].value = 'balcony'
+    assert task.contexts == ['balcony', 'garden', 'kitchen']
+    task.tokens[6].value = 'hall'
+    assert task.contexts == ['balcony', 'hall', 'kitchen']
+    assert task not in TaskContext.index['garden']
+    task = Task('d due:2000-01-01 due:2999-01-01')
+    task.tokens[6].value = date(2998, 1, 1)
+    assert task.due_date == date(2000, 1, 1)
+    assert task in TaskDueDate.index[date(2000, 1, 1)]
+    assert task not in TaskDueDate.index[date(2998, 1, 1)]
+
+
+def test_custom_token_without_base_init():
+    class MoodToken(BaseToken):
+        html_pattern = '<i>{name}</i>'
+        parse_pattern = r'^%(?P<value>\w+)$'
+        str_pattern = '%{name}'
+        type = str
+
+        def __init__(self, value, task=None):
+            self.value = value.lstrip('%')
+            self.task = task
+
+    try:
+        task = Task('write tests %happy')
+        assert isinstance(task.tokens[-1], MoodToken)
+        assert str(task) == 'write tests %happy'
+        assert task.html == '<div class="task">write tests <i>happy</i></div>'
+        task += '%focused'
+        assert str(task) == 'write tests %happy %focused'
+        assert task.html == '<div class="task">write tests <i>happy</i> <i>focused</i></div>'
+    finally:
+        unregister(MoodToken)
 
 
 def test_manager():
@@ -405,9 +724,37 @@ def test_manager():
     query = all_tasks.filter(priority=2, context=TaskContext('context1'))
     assert not query
 
+    task3 = Task('pay the rent due:2000-01-01')
+    query = Task.all_tasks().filter(due_date=date(2000, 1, 1), projects=[])
+    assert len(query) == 1
+    assert task3 in query
+
+    task4 = Task('x 2000-01-02 (A) water the plants')
+    assert Task.all_tasks().list == [task1, task2, task3, task4]
+
+
+def test_parse_many():
+    tasks = Task.parse_many(['(A) call mom @phone\n', '\n', 'x 2000-01-01 pay the rent\r\n', '   ', 'tidy up'])
+    assert tasks == ['(A) call mom @phone', 'x 2000-01-01 pay the rent', 'tidy up']
+    assert all(isinstance(x, Task) for x in tasks)
+    assert tasks[0] in TaskContext.index['phone']
+
+
+def test_instances_have_no_dict():
+    task = Task('x 2000-01-02 (A) 2000-01-01 read @home +books due:2000-01-03 t:2000-01-01 https://example.org')
+    assert not hasattr(task, '__dict__')
+    assert {type(x) for x in task.tokens} == {TaskCompletedDate, TaskContext, TaskCreatedDate, TaskDueDate,
+                                              TaskPriority, TaskProject, TaskString, TaskThresholdDate, Url}
+    assert not any(hasattr(x, '__dict__') for x in task.tokens)
+
 
 def test_weak_index_setting():
     Task.set_weak_index(False)
     assert isinstance(Task._all_tasks, set)
+    task = Task('kept in a strong index')
+    assert task in Task._all_tasks
     Task.set_weak_index(True)
     assert isinstance(Task._all_tasks, WeakSet)
+    assert task in Task._all_tasks
+    task = Task('kept in a weak index')
+    assert task in Task._all_tasks
@@ -4,35 +4,48 @@ This module provides a pythonic interface to Gina Trapani's todo.txt_-format for
 .. _todo.txt: http://todotxt.com
 """
 
-from collections import defaultdict, Iterable
+from collections import Counter, defaultdict, Iterable
+from contextlib import contextmanager
 import datetime
-import inspect
+from functools import lru_cache
+from itertools import count
 import operator
 import re
-from weakref import WeakSet
+from string import ascii_uppercase
+import sys
+import threading
+from weakref import WeakKeyDictionary, WeakSet
 
 
 __version__ = '0.1-1'
 SOURCE_URL = 'https://github.com/funkyfuture/todo.txt-pylib'
 
 
-__operators = {}
+__operators = {'in': operator.contains}
+__operators.update((x, getattr(operator, x)) for x in ('contains', 'eq', 'ge', 'gt', 'le', 'lt', 'ne'))
 
 
 def get_operator_function(name):
-    if name == 'in':
-        return operator.contains
     if name not in __operators:
-        __operators[name] = dict(inspect.getmembers(operator))[name]
+        __operators[name] = vars(operator)[name]
     return __operators[name]
 
 
+_today_override = threading.local()
+
+
+def _today():
+    """ Returns the current date, or the date that has been fixed for the current thread by :meth:`Task.today_batch`.
+    """
+    return getattr(_today_override, 'date', None) or datetime.date.today()
+
+
 class TaskManager(WeakSet):
     """ A set of tasks that can be filtered. """
     @property
     def list(self):
-        # TODO
-        return sorted(self)
+        """ The tasks as sorted :class:`list`, see :meth:`Task._sort_key` for the order. """
+        return sorted(self, key=Task._sort_key)
 
     def filter(self, **criterias):
         """ Filter all tasks that match the criterias passed as keyword-arguments.
@@ -49,23 +62,69 @@ class TaskManager(WeakSet):
         :return: A new set of tasks.
         :rtype: :class:`TaskManager`
         """
-        matches = self.copy()
+        matches = None
+        scanned_criterias = []
         for criteria, argument in criterias.items():
-            criteria_matches = set()
-            attribute, op, swap_operands = self.__figure_out_task_attribute_and_operator(criteria)
-            for task in self:
-                value = getattr(task, attribute)
-                if value is None:
-                    continue
-                a, b = (argument, value) if swap_operands else (value, argument)
-                if op(a, b):
-                    criteria_matches.add(task)
-            matches &= criteria_matches
-        return matches
+            attribute, op, swap_operands, token_type = self.__figure_out_task_attribute_and_operator(criteria)
+            criteria_matches = self.__lookup_index(token_type, op, swap_operands, argument)
+            if criteria_matches is None:
+                scanned_criterias.append((attribute, op, swap_operands, argument))
+            elif matches is None:
+                matches = criteria_matches
+            else:
+                matches &= criteria_matches
+
+        # the tasks are materialized once, either all of them or those of this set that the indexes left
+        if matches is None:
+            matches = list(self)
+        else:
+            matches = [x for x in matches if x in self]
+
+        # criterias that can't be looked up are only tested against the tasks that are left by the indexes
+        with Task.today_batch():
+            for attribute, op, swap_operands, argument in scanned_criterias:
+                get_value = operator.attrgetter(attribute)
+                if swap_operands:
+                    def predicate(value, op=op, argument=argument):
+                        return op(argument, value)
+                else:
+                    def predicate(value, op=op, argument=argument):
+                        return op(value, argument)
+                criteria_matches = []
+                for task in matches:
+                    value = get_value(task)
+                    if value is not None and predicate(value):
+                        criteria_matches.append(task)
+                matches = criteria_matches
+        return TaskManager(matches)
 
     def tuple(self):
         return tuple(self.list)
 
+    @staticmethod
+    def __lookup_index(token_type, op, swap_operands, argument):
+        """ Returns the tasks that match a criteria from the index of the token type that the criteria's attribute
+            refers to, or :obj:`None` if the criteria can't be answered by an index. """
+        if token_type is None:
+            return None
+
+        def tasks(value):
+            if isinstance(value, token_type):
+                value = value.value
+            return token_type.index.get(value, ())
+
+        try:
+            if token_type.is_singleton:
+                if op is operator.eq:
+                    return set(tasks(argument))
+                if op is operator.contains and swap_operands:
+                    return set().union(*(tasks(x) for x in argument))
+            elif op is operator.contains and not swap_operands:
+                return set(tasks(argument))
+        except TypeError:  # unhashable arguments
+            pass
+        return None
+
     @staticmethod
     def __figure_out_task_attribute_and_operator(criteria):
         swap_operands = False
@@ -85,7 +144,7 @@ class TaskManager(WeakSet):
         elif op is operator.contains:
             swap_operands = True
 
-        return attribute, op, swap_operands
+        return attribute, op, swap_operands, indexed_attributes.get(attribute)
 
     def __str__(self):
         return self
@@ -132,7 +191,12 @@ class Task:
     :meth:`all_tasks`, :meth:`active_tasks`, :meth:`completed_tasks`, :meth:`future_tasks`, :meth:`overdue_tasks`
     """
 
+    __slots__ = ('tokens', '_dates_cache', '_sort_key_cache', '_str_cache', '__weakref__')
+
     _all_tasks = WeakSet()
+    _register_task = _all_tasks.add
+    _modifications = 0
+    _query_cache = {}
     html_element = 'div'
     """ The HTML-element that wraps the task in :attr:`html`. """
     html_class = 'task'
@@ -150,40 +214,49 @@ class Task:
     """ If a key in this mapping is in :attr:`projects`, the the value is added to the classes of :attr:`html`. """
 
     def __init__(self, line):
-        self.tokens = line.split(' ')
-        """ The tokens of a task. """
-
-        if self.tokens[0] == 'x':
-            self.tokens[0] = TaskString('x')
-            if TaskCompletedDate.parse_pattern.match(self.tokens[1]):
-                self.tokens[1] = TaskCompletedDate(self.tokens[1], self)
-            else:
-                self.tokens.insert(1, None)
+        self._modified()
+        # surrounding whitespace, e.g. a line break, is not part of any token
+        parts = line.strip().split(' ')
+        # the prefix tokens are taken from the leading parts, the position points to the first part that is left
+        position, length = 0, len(parts)
+
+        completion_marker = completion_date = created_date = None
+        if parts[0] == 'x':
+            completion_marker = TaskString('x')
+            position = 1
+            match = position < length and TaskCompletedDate.parse_pattern.match(parts[position])
+            if match:
+                completion_date = TaskCompletedDate._from_match(match, self)
+                position += 1
+
+        match = position < length and TaskPriority.parse_pattern.match(parts[position])
+        if match:
+            priority = TaskPriority._from_match(match, self)
+            position += 1
         else:
-            self.tokens.insert(0, None)
-            self.tokens.insert(1, None)
+            priority = TaskPriority(0, self)
 
-        if TaskPriority.parse_pattern.match(self.tokens[2]):
-            self.tokens[2] = TaskPriority(self.tokens[2], self)
-        else:
-            self.tokens.insert(2, TaskPriority(0, self))
-
-        if TaskCreatedDate.parse_pattern.match(self.tokens[3]):
-            self.tokens[3] = TaskCreatedDate(self.tokens[3], self)
-        else:
-            self.tokens.insert(3, None)
+        match = position < length and TaskCreatedDate.parse_pattern.match(parts[position])
+        if match:
+            created_date = TaskCreatedDate._from_match(match, self)
+            position += 1
 
-        for i, token in enumerate(self.tokens[4:], start=4):
-            self.tokens[i] = self.__parse_string_to_token(token)
+        parse = self.__parse_string_to_token
+        tokens = [parse(x, self) for x in parts[position:]]
+        self.tokens = [completion_marker, completion_date, priority, created_date] + tokens
+        """ The tokens of a task. """
 
-        self._all_tasks.add(self)
+        self._register_task(self)
 
-    def __parse_string_to_token(self, string):
-        for token_type in unambiguous_token_types:
-            if token_type.parse_pattern.match(string):
-                return token_type(string, self)
-        else:
+    @staticmethod
+    def __parse_string_to_token(string, task=None):
+        classification = _classify(string)
+        if classification is None:
             return TaskString(string)
+        token_type, value = classification
+        if token_type._casts_parsed_values:
+            return token_type._from_value(value, task)
+        return token_type(string, task)
 
     def __iadd__(self, value):
         """ Add a token to a task.
@@ -201,32 +274,33 @@ class Task:
         :param value: The token to add.
         :type value: a subclass of :class:`BaseToken` or :class:`str`
         """
-        value = self.__handle_iterable_value_for_operator(value, self.__iadd__)
-        if value is None:
-            return self
-
-        if not isinstance(value, tuple(token_types)):
-            raise ValueError('{} is not supported by this operation.'.format(value.__class__.__name__))
-
-        value.task = self
-        if isinstance(value, BaseIndexedToken):
-            if value.is_singleton:
-                value.__class__.index._discard(self)
-                if value.fixed_pos:
-                    self.tokens[value.fixed_pos] = value
-                else:
-                    for i in range(1, len(self.tokens)):
-                        if isinstance(self.tokens[i], type(value)):
-                            self.tokens[i] = value
-                            break
+        tokens = self.__tokens_from_operand(value)
+        for token in tokens:
+            if not isinstance(token, _token_types_tuple):
+                raise ValueError('{} is not supported by this operation.'.format(token.__class__.__name__))
+
+        for token in tokens:
+            if isinstance(token, BaseToken):
+                token.task = self
+            if isinstance(token, BaseIndexedToken):
+                if token.is_singleton:
+                    token.__class__.index._discard(self)
+                    if token.fixed_pos:
+                        self.tokens[token.fixed_pos] = token
                     else:
-                        self.tokens.append(value)
+                        for i in range(1, len(self.tokens)):
+                            if isinstance(self.tokens[i], type(token)):
+                                self.tokens[i] = token
+                                break
+                        else:
+                            self.tokens.append(token)
+                else:
+                    self.tokens.append(token)
+                token.__class__.index.add(token.value, self)
             else:
-                self.tokens.append(value)
-            value.__class__.index[value.value].add(self)
-        else:
-            self.tokens.append(value)
+                self.tokens.append(token)
 
+        self._modified()
         return self
 
     def __isub__(self, value):
@@ -244,147 +318,192 @@ class Task:
         :param value: The token to remove
         :type value: a subclass of :class:`BaseToken` or :class:`str`
         """
-        value = self.__handle_iterable_value_for_operator(value, self.__isub__)
-        if value is None:
-            return self
-
-        if not (isinstance(value, tuple(token_types)) or
-                inspect.isclass(value) and issubclass(value, BaseToken) and value.is_singleton):
-            raise ValueError('{} is not supported by this operation.'.format(value.__class__.__name__))
-
-        value_class = value if inspect.isclass(value) else value.__class__
-
-        if value.is_singleton:
-            if value.fixed_pos:
-                self.tokens[value.fixed_pos] = None
-                value_class.index._discard(self)
+        tokens = self.__tokens_from_operand(value)
+        for token in tokens:
+            if not (isinstance(token, _token_types_tuple) or
+                    isinstance(token, type) and token in token_types and token.is_singleton):
+                name = token.__name__ if isinstance(token, type) else token.__class__.__name__
+                raise ValueError('{} is not supported by this operation.'.format(name))
+
+        removals = Counter()
+        for token in tokens:
+            token_class = token if isinstance(token, type) else token.__class__
+            if not token.is_singleton:
+                removals[token_class, token.value] += 1
+            elif token.fixed_pos:
+                self.tokens[token.fixed_pos] = None
+                token_class.index._discard(self)
             else:
-                for i in self._unfixed_tokens_range:
-                    if self.tokens[i].__class__ == value_class:
+                for i in range(4, len(self.tokens)):
+                    if type(self.tokens[i]) is token_class:
                         del self.tokens[i]
-                        value_class.index._discard(self)
+                        token_class.index._discard(self)
+                        # a further token of the type is what the task's property returns now
+                        for further in self.tokens[i:]:
+                            if type(further) is token_class:
+                                token_class.index.add(further.value, self)
+                                break
                         break
-        else:
-            for i in self._unfixed_tokens_range:
-                if self.tokens[i].__class__ == value_class and self.tokens[i].value == value.value:
-                    del self.tokens[i]
-                    if isinstance(value, BaseIndexedToken):
-                        value_class.index[value.value].discard(self)
-                    break
 
+        if removals:
+            # the first occurrences of all tokens to remove are dropped in one pass
+            kept, removed = [], []
+            for token in self.tokens[4:]:
+                key = type(token), token.value
+                if removals[key]:
+                    removals[key] -= 1
+                    removed.append(key)
+                else:
+                    kept.append(token)
+            self.tokens[4:] = kept
+            # a task stays indexed with a value that another of its tokens still holds
+            remaining = {(type(x), x.value) for x in kept}
+            for token_class, token_value in removed:
+                if issubclass(token_class, BaseIndexedToken) and (token_class, token_value) not in remaining:
+                    token_class.index.discard(token_value, self)
+
+        self._modified()
         return self
 
-    def __handle_iterable_value_for_operator(self, value, op):
+    def _modified(self):
+        """ Invalidates the cached string representation, the sort key, the due and threshold date tokens and the
+            results of cached queries. """
+        self._dates_cache = self._sort_key_cache = self._str_cache = None
+        Task._modifications += 1
+
+    def __tokens_from_operand(self, value):
+        """ Flattens an operand of the ``+=`` and ``-=`` operators into a list of tokens and parses strings. The
+            parsed tokens aren't bound to the task, only ``+=`` indexes the task with the tokens it adds. """
         if isinstance(value, str):
-            if ' ' in value:
-                for word in value.split(' '):
-                    op(word)
-                return None
-            else:
-                return self.__parse_string_to_token(value)
+            return [self.__parse_string_to_token(x) for x in value.split(' ')]
         elif isinstance(value, Iterable):
-            for item in value:
-                op(item)
-            return None
+            return [token for item in value for token in self.__tokens_from_operand(item)]
         else:
-            return value
+            return [value]
 
     def __contains__(self, item):
-        """ Test if a token or a string is contained in the task.
+        """ Test if a token, a token type or a string is contained in the task.
 
         Example:
 
         >>> [ x for x in tasks if TaskPriority(1) in x ]
+        >>> [ x for x in tasks if TaskDueDate in x ]
         """
-        if item in self.tokens:
-            return True
-        if item in str(self):
-            return True
-        return False
+        if isinstance(item, str):
+            return item in str(self) or item in self.tokens
+        if isinstance(item, type):
+            # the placeholder of a missing priority isn't contained
+            return any(isinstance(x, item) for x in self.tokens if x)
+        if isinstance(item, BaseToken):
+            # only tokens of the same type are compared, a context isn't contained as project or plain string
+            if item.fixed_pos is not None:
+                return self.tokens[item.fixed_pos] == item
+            token_type, value = item.__class__, item.value
+            return any(x.value == value for x in self.tokens if isinstance(x, token_type))
+        return item in self.tokens
 
     def __hash__(self):
         # necessary to add a task to a set, not actually a hash
         return id(self)
 
     def __eq__(self, other):
+        if other is self:
+            return True
+        if isinstance(other, str):
+            return str(self) == other
         return str(self) == str(other)
 
     def __lt__(self, other):
-        if not self.is_completed and other.is_completed:
-            return True
-        elif self.is_completed and not other.is_completed:
-            return False
-        if self.priority > other.priority:
-            return True
-        if self.threshold_date is not None:
-            if other.threshold_date is None:
-                return False
-            if self.threshold_date < other.threshold_date:
-                return True
-        if self.due_date is not None:
-            if other.due_date is None:
-                return True
-            if self.due_date < other.due_date:
-                return True
-        if self.completion_date is not None:
-            if other.completion_date is None:
-                return True
-            if self.completion_date > other.completion_date:
-                return True
-        if self.created_date is not None:
-            if other.created_date is None:
-                return True
-            if self.created_date > other.created_date:
-                return True
-        if str(self) < str(other):
-            return True
-        return False
+        return self._sort_key() < other._sort_key()
 
     def __gt__(self, other):
-        return not self < other and not self == other
+        return self._sort_key() > other._sort_key()
 
     def __ne__(self, other):
         return not self == other
 
     def __str__(self):
-        return ' '.join(str(x) for x in self.tokens if x).strip()
+        if self._str_cache is None:
+            self._str_cache = ' '.join([str(x) for x in self.tokens if x])
+        return self._str_cache
 
     def __repr__(self):
         return "'{string}'".format(string=str(self))
 
-    @property
-    def _unfixed_tokens_range(self):
-        return range(4, len(self.tokens))
+    def _sort_key(self):
+        """ Returns the key that tasks are sorted by: uncompleted before completed tasks, then by priority, tasks
+            without or with an earlier threshold date first, tasks with an earlier due date first, then the latest
+            completion and creation dates and finally the string representation. """
+        if self._sort_key_cache is None:
+            priority, threshold_date, due_date = self.priority, self.threshold_date, self.due_date
+            completion_date, created_date = self.completion_date, self.created_date
+            self._sort_key_cache = (
+                self.is_completed,
+                priority.value if priority else 27,
+                threshold_date.value.toordinal() if threshold_date else 0,
+                due_date.value.toordinal() if due_date else datetime.date.max.toordinal() + 1,
+                -completion_date.value.toordinal() if completion_date else 0,
+                -created_date.value.toordinal() if created_date else 0,
+                str(self))
+        return self._sort_key_cache
+
+    def _find_dates(self):
+        """ Finds the first due and threshold date tokens in one pass and caches them until the task is modified. """
+        due_date = threshold_date = None
+        for token in self.tokens[4:]:
+            if isinstance(token, TaskDueDate):
+                if due_date is None:
+                    due_date = token
+            elif isinstance(token, TaskThresholdDate):
+                if threshold_date is None:
+                    threshold_date = token
+        self._dates_cache = (due_date, threshold_date)
+        return self._dates_cache
 
     @classmethod
     def all_tasks(cls):
         """ Returns a :class:`TaskManager` with all tasks. """
         return TaskManager(cls._all_tasks)
 
+    @classmethod
+    def _cached_query(cls, name, query):
+        """ Returns a copy of a query's result that is cached until a task is created or modified, the set of tasks
+            is altered otherwise or the date changes. """
+        key = (_today(), Task._modifications, len(cls._all_tasks))
+        cached = Task._query_cache.get(name)
+        if cached is None or cached[0] != key:
+            cached = Task._query_cache[name] = (key, query(key[0]))
+        return cached[1].copy()
+
     @classmethod
     def active_tasks(cls):
         """ Returns a :class:`TaskManager` with tasks that are not completed and not on threshold. """
-        return cls.all_tasks() - cls.completed_tasks() - cls.future_tasks()
+        return cls._cached_query(
+            'active', lambda today: cls.all_tasks() - cls.completed_tasks() - cls.future_tasks())
 
     @classmethod
     def completed_tasks(cls):
         """ Returns a :class:`TaskManager` with all completed tasks. """
-        return cls.all_tasks().filter(is_completed=True)
+        return cls._cached_query('completed', lambda today: cls.all_tasks().filter(is_completed=True))
 
     @classmethod
     def future_tasks(cls):
         """ Returns a :class:`TaskManager` with tasks whose threshold-date is in the future. """
-        return cls.all_tasks().filter(threshold_date__gt=datetime.date.today())
+        return cls._cached_query('future', lambda today: cls.all_tasks() & TaskManager(
+            task for date, tasks in TaskThresholdDate.index.items() if date.toordinal() > today.toordinal()
+            for task in tasks))
 
     @classmethod
     def overdue_tasks(cls):
         """ Returns a :class:`TaskManager` with overdue tasks. """
-        return cls.all_tasks().filter(due_date__lt=datetime.date.today())
+        return cls._cached_query('overdue', lambda today: cls.all_tasks() & TaskManager(
+            task for date, tasks in TaskDueDate.index.items() if date.toordinal() < today.toordinal()
+            for task in tasks))
 
     @property
     def contexts(self):
         """ The contexts of a task. """
-        return sorted(x for x in TaskContext.index if self in TaskContext.index[x])
+        return sorted(TaskContext.index.values_of(self))
 
     @property
     def completion_date(self):
@@ -407,10 +526,7 @@ class Task:
     @property
     def due_date(self):
         """ The date when a task is due. """
-        for token in self.tokens[4:]:
-            if isinstance(token, TaskDueDate):
-                return token
-        return None
+        return (self._dates_cache or self._find_dates())[0]
 
     @due_date.setter
     def due_date(self, value):
@@ -420,11 +536,9 @@ class Task:
     @property
     def html(self):
         """ HTML-representation of a task. """
-        return '<{element}{classes}>{task}</{element}>'.format(
-            element=self.html_element,
-            classes=self.html_classes_string,
-            task=' '.join(x.html for x in self.tokens if x)
-        )
+        element = self.html_element
+        tokens = ' '.join([x.html for x in self.tokens if x])
+        return '<' + element + self.html_classes_string + '>' + tokens + '</' + element + '>'
 
     @property
     def html_classes_string(self):
@@ -436,12 +550,11 @@ class Task:
         for attribute, klass in self.html_property_class_mapping.items():
             if getattr(self, attribute):
                 result.append(klass)
-        for context, klass in self.html_context_class_mapping.items():
-            if context in self.contexts:
-                result.append(klass)
-        for project, klass in self.html_project_class_mapping.items():
-            if project in self.projects:
-                result.append(klass)
+        for token_type, mapping in ((TaskContext, self.html_context_class_mapping),
+                                    (TaskProject, self.html_project_class_mapping)):
+            if mapping:
+                values = sorted({x.value for x in self.tokens if isinstance(x, token_type)})
+                result.extend(mapping[x] for x in values if x in mapping)
         if result:
             return ' class="' + ' '.join(result) + '"'
         else:
@@ -455,19 +568,22 @@ class Task:
     @is_completed.setter
     def is_completed(self, value):
         if bool(value):
-            self.tokens[0] = 'x'
-            self += TaskCompletedDate(datetime.date.today())
+            self.tokens[0] = TaskString('x')
+            self += TaskCompletedDate(_today())
         else:
-            self.tokens[0] = ' '
+            self.tokens[0] = None
             self -= TaskCompletedDate()
+        self._modified()
 
     @property
     def is_on_threshold(self):
-        return self.threshold_date and self.threshold_date > datetime.date.today()
+        threshold_date = self.threshold_date
+        return threshold_date and threshold_date.value.toordinal() > _today().toordinal()
 
     @property
     def is_overdue(self):
-        return self.due_date and self.due_date < datetime.date.today()
+        due_date = self.due_date
+        return due_date and due_date.value.toordinal() < _today().toordinal()
 
     @property
     def priority(self):
@@ -481,20 +597,31 @@ class Task:
     @property
     def projects(self):
         """ The projects of a task. """
-        return sorted(x for x in TaskProject.index if self in TaskProject.index[x])
+        return sorted(TaskProject.index.values_of(self))
 
     @property
     def threshold_date(self):
         """ The date until when a task is on threshold. """
-        for token in self.tokens[4:]:
-            if isinstance(token, TaskThresholdDate):
-                return token
-        return None
+        return (self._dates_cache or self._find_dates())[1]
 
     @threshold_date.setter
     def threshold_date(self, value):
         self += TaskThresholdDate(value)
 
+    @classmethod
+    def parse_many(cls, lines):
+        """ Creates tasks from lines in todo.txt-format, e.g. from a file. Line breaks are removed and blank lines are
+            skipped.
+
+        >>> with open('todo.txt', 'rt') as f:
+        ...     tasks = Task.parse_many(f)
+
+            :param lines: The lines to parse.
+            :type lines: an iterable of :class:`str`
+            :rtype: :class:`list` of :class:`Task`
+        """
+        return [cls(line) for line in (x.rstrip('\r\n') for x in lines) if line and not line.isspace()]
+
     @classmethod
     def set_weak_index(cls, setting):
         """ Sets whether to keep tasks in a weak-referenced container or not.
@@ -510,15 +637,140 @@ class Task:
             Task._all_tasks = WeakSet(Task._all_tasks)
         elif not setting and isinstance(cls._all_tasks, WeakSet):
             Task._all_tasks = set(Task._all_tasks)
+        else:
+            return
+        Task._register_task = Task._all_tasks.add
+
+    @classmethod
+    @contextmanager
+    def today_batch(cls):
+        """ A context manager that determines the current date once for all date comparisons that the current thread
+            makes within its context, e.g. when many tasks are rendered:
+
+            >>> with Task.today_batch():
+            ...     html = [x.html for x in tasks]
+        """
+        outer = getattr(_today_override, 'date', None)
+        if outer is None:
+            _today_override.date = datetime.date.today()
+        try:
+            yield _today_override.date
+        finally:
+            _today_override.date = outer
 
 
 token_types = set()
 """ All token types. """
+_token_types_tuple = ()
 _fixed_positions = set()
 fixed_token_types = []
 """ All token types with a fixed position within a task's tokens sequence. """
 unambiguous_token_types = set()
 """ The token types that can clearly be identified by their string representation. """
+indexed_attributes = {}
+""" A mapping of :class:`Task`-properties to the indexed token types they refer to. """
+_tokenizer = None
+_token_tags = count()
+_frequent_token_types = ('TaskContext', 'TaskProject', 'TaskDueDate', 'TaskThresholdDate', 'Url')
+""" Names of token types that the tokenizer tries first, ordered by their expected frequency. """
+_inline_flags = (('i', re.IGNORECASE), ('m', re.MULTILINE), ('s', re.DOTALL), ('x', re.VERBOSE))
+_numbered_group_reference = re.compile(r'\\[1-9]|\(\?\(\d')
+
+
+def _tokenizer_order(token_type):
+    if token_type.__name__ in _frequent_token_types and token_type.__module__ == __name__:
+        return _frequent_token_types.index(token_type.__name__), token_type._tag
+    return len(_frequent_token_types), token_type._tag
+
+
+def _is_fusable(pattern):
+    """ Whether a parse pattern matches the same within the tokenizer's alternation as on its own. That isn't the case
+        for patterns with flags that can't be inlined or with references to groups by number, as the numbers are
+        shifted within the alternation. """
+    flags = pattern.flags & ~re.UNICODE
+    for _, value in _inline_flags:
+        flags &= ~value
+    return not flags and _numbered_group_reference.search(pattern.pattern) is None
+
+
+def _compile_alternation(fusable_types):
+    """ Combines the parse patterns of token types into one alternation. Each alternative is wrapped in a group named
+        after the token type's tag; the group's index maps to the token type and the renamed ``value``-group of its
+        pattern. """
+    alternatives, groups = [], {}
+    for token_type in fusable_types:
+        group = '_t{}'.format(token_type._tag)
+        pattern = re.sub(r'\(\?P([<=])(\w+)', r'(?P\1{}_\2'.format(group), token_type.parse_pattern.pattern)
+        if pattern.startswith('^'):
+            pattern = pattern[1:]
+        if pattern.endswith('$') and not pattern.endswith('\\$'):
+            pattern = pattern[:-1]
+        flags = ''.join(flag for flag, value in _inline_flags if token_type.parse_pattern.flags & value)
+        if flags:
+            pattern = '(?{}:{})'.format(flags, pattern)
+        alternatives.append('(?P<{}>{})'.format(group, pattern))
+        groups[group] = (token_type, group + '_value')
+
+    alternation = re.compile('(?:{})\n?'.format('|'.join(alternatives)))
+    alternation_groups = [None] * (alternation.groups + 1)
+    for group, index in alternation.groupindex.items():
+        if group in groups:
+            alternation_groups[index] = groups[group]
+    return alternation, alternation_groups, None
+
+
+def _compile_tokenizer():
+    """ Combines the parse patterns of all :data:`unambiguous_token_types` into alternations, so that a string is
+        classified by a single match instead of one match per token type. Patterns that wouldn't match the same within
+        an alternation are matched on their own between the alternations of their neighbours.
+
+        A string must be matched as a whole, so the patterns' anchors are dropped and a pattern without anchors
+        can't swallow a part of a word. Like the ``$`` anchor, the tokenizer allows a trailing new line that isn't
+        part of any group. The alternatives are tried in order; the :data:`_frequent_token_types` lead, other types
+        follow in the order of their registration. The tokenizer is compiled on demand after a token type has been
+        registered. """
+    global _tokenizer
+
+    tokenizer, fusable = [], []
+    for token_type in sorted(unambiguous_token_types, key=_tokenizer_order):
+        if _is_fusable(token_type.parse_pattern):
+            fusable.append(token_type)
+            continue
+        if fusable:
+            tokenizer.append(_compile_alternation(fusable))
+            fusable = []
+        tokenizer.append((token_type.parse_pattern, None, token_type))
+    if fusable:
+        tokenizer.append(_compile_alternation(fusable))
+
+    _tokenizer = tokenizer
+    return _tokenizer
+
+
+def _reset_tokenizer():
+    """ Discards the tokenizer and the cached classifications, e.g. after :data:`unambiguous_token_types` changed. """
+    global _tokenizer
+    _tokenizer = None
+    _classify.cache_clear()
+
+
+@lru_cache(maxsize=4096)
+def _classify(string):
+    """ Returns the token type and the value string that the tokenizer finds for a string, or :obj:`None` for plain
+        strings. As words recur a lot within a todo.txt file, the results are cached; the cache is cleared when a
+        token type is registered. """
+    for pattern, groups, token_type in (_tokenizer or _compile_tokenizer()):
+        if groups is None:
+            # a pattern that is matched on its own
+            match = pattern.fullmatch(string[:-1] if string.endswith('\n') else string)
+            if match is not None:
+                return token_type, match.group('value')
+        else:
+            match = pattern.fullmatch(string)
+            if match is not None:
+                token_type, value_group = groups[match.lastindex]
+                return token_type, match.group(value_group)
+    return None
 
 
 class _RegisterClass(type):
@@ -529,7 +781,8 @@ class _RegisterClass(type):
         for attribute, _type in (('fixed_pos', (int, None.__class__)),
                                  ('html_pattern', str),
                                  ('is_singleton', bool),
-                                 ('str_pattern', str)):
+                                 ('str_pattern', str),
+                                 ('task_attribute', (str, None.__class__))):
             if attribute in attributes:
                 assert isinstance(attributes[attribute], _type)
 
@@ -548,15 +801,27 @@ class _RegisterClass(type):
 
         return super().__new__(cls, name, bases, attributes)
 
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        if name == 'str_pattern':
+            # the tasks' cached string representations were rendered with the former pattern
+            for task in list(Task._all_tasks):
+                task._modified()
+
     def __init__(cls, name, bases, attributes):
         super().__init__(name, bases, attributes)
 
         if name.startswith('Base'):
             return
 
-        global _fixed_positions, fixed_token_types, token_types, unambiguous_token_types
+        global _fixed_positions, fixed_token_types, token_types, unambiguous_token_types, _token_types_tuple
 
         token_types.add(cls)
+        _token_types_tuple = tuple(token_types)
+        cls._tag = next(_token_tags)
+        # parsed values are cast directly, unless a type customizes its construction
+        cls._casts_parsed_values = all(next(x for x in cls.__mro__ if method in vars(x)).__module__ == __name__
+                                       for method in ('__init__', '_duck'))
 
         for token_type in unambiguous_token_types:
             if cls.parse_pattern.pattern == token_type.parse_pattern.pattern:
@@ -564,6 +829,10 @@ class _RegisterClass(type):
                 break
         else:
             unambiguous_token_types.add(cls)
+        _reset_tokenizer()
+
+        if getattr(cls, 'task_attribute', None) is not None:
+            indexed_attributes[cls.task_attribute] = cls
 
         if cls.fixed_pos is not None:
             _fixed_positions.add(cls.fixed_pos)
@@ -573,7 +842,8 @@ class _RegisterClass(type):
 
 class _RegisterLeafClassesWithIndex(_RegisterClass):
     def __new__(cls, name, bases, atttributes):
-        atttributes['index'] = TokenIndex()
+        if atttributes.get('index') is None:
+            atttributes['index'] = TokenIndex()
         return super().__new__(cls, name, bases, atttributes)
 
 
@@ -586,6 +856,8 @@ class BaseToken(metaclass=_RegisterClass):
         :type task: :class:`Task`
     """
 
+    __slots__ = ('task', '_value', '_html_cache', '_str_cache')
+
     fixed_pos = None
     """ The fixed position of this token type in the :attr:`Task.tokens` or :obj:`None`. """
     html_pattern = None
@@ -599,27 +871,47 @@ class BaseToken(metaclass=_RegisterClass):
     """ The pattern to format the string-representation of a token. """
     type = None
     """ The types that can be converted to the token's value representation. """
-    value = None
-    """ The token's internal value representation. """
 
     def __init__(self, value, task):
+        self._html_cache = self._str_cache = None
         if value is None:
-            self.value = None
+            self._value = None
             self.task = None
         else:
             if not isinstance(value, (self.type, self.__class__)) and value is not None:
                 raise ValueError('Expecting a {type} or {cls} instance.'.format(cls=self.__class__, type=self.type))
-            self.value = self._duck(value)
+            self._value = self._duck(value)
             self.task = task
 
+    @classmethod
+    def _cast(cls, value):
+        """ Cast a string that was extracted by :attr:`parse_pattern` into the class' value type. """
+        return sys.intern(value)
+
     @classmethod
     def _duck(cls, value):
         """ Cast the given input into the class' value type. """
-        if cls.parse_pattern.match(value):
-            return cls.parse_pattern.match(value).group('value')
+        match = cls.parse_pattern.match(value)
+        if match:
+            return _cached_cast(cls, match.group('value'))
         else:
             return value
 
+    @classmethod
+    def _from_match(cls, match, task, group='value'):
+        """ Create a token from a match whose ``group`` holds the token's value. As the matched string has already
+            been classified, it isn't parsed again. """
+        return cls._from_value(match.group(group), task)
+
+    @classmethod
+    def _from_value(cls, value, task):
+        """ Create a token from the string that :attr:`parse_pattern` extracts as value. """
+        token = cls.__new__(cls)
+        token._value = _cached_cast(cls, value)
+        token.task = task
+        token._html_cache = token._str_cache = None
+        return token
+
     @classmethod
     def _other_value(cls, other):
         """ Get the value-property of other if it's the same class. """
@@ -648,45 +940,151 @@ class BaseToken(metaclass=_RegisterClass):
     @property
     def html(self):
         """ The HTML-representation of the token. """
-        return self.html_pattern.format(name=self.name)
+        return self._cached_render('_html_cache', self.html_pattern)
 
     @property
     def name(self):
         """ The token's string representation without any type indicator. """
         return self.value
 
+    @property
+    def value(self):
+        """ The token's internal value representation. """
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        # the referencing task's cached string representation and sort key are outdated
+        task = getattr(self, 'task', None)
+        if task is not None:
+            task._modified()
+
+    def _render(self, pattern):
+        """ Fills the token's name into a string- or HTML-pattern. """
+        parts = _split_pattern(pattern)
+        return pattern.format(name=self.name) if parts is None else str(self.name).join(parts)
+
+    def _cached_render(self, cache_slot, pattern):
+        """ Returns the token rendered with a pattern, cached in the given slot along with the pattern and the value
+            it was rendered with. A pattern or value that is reassigned at runtime is thus rendered anew. """
+        value = self._value
+        # tokens of types whose __init__ doesn't call BaseToken.__init__ have no cache yet
+        cache = getattr(self, cache_slot, None)
+        if cache is None or cache[0] is not pattern or cache[1] is not value:
+            cache = pattern, value, self._render(pattern)
+            setattr(self, cache_slot, cache)
+        return cache[2]
+
     def __str__(self):
-        return self.str_pattern.format(name=self.name)
+        return self._cached_render('_str_cache', self.str_pattern)
+
+
+@lru_cache(maxsize=None)
+def _split_pattern(pattern):
+    """ Splits a format pattern around its ``{name}`` fields, so that it can be filled in with :meth:`str.join`.
+        Returns :obj:`None` for patterns with other fields, they need to be formatted. """
+    parts = tuple(pattern.split('{name}'))
+    if any('{' in x or '}' in x for x in parts):
+        return None
+    return parts
+
+
+@lru_cache(maxsize=4096)
+def _cached_cast(token_type, string):
+    """ Casts a string with the :meth:`BaseToken._cast` method of the given token type. Recurring strings thus share
+        one value object and the costly parsing of dates is done once per distinct string. """
+    return token_type._cast(string)
 
 
 class TokenIndex(defaultdict):
-    """ An index of task-tokens; tasks grouped by token value. """
-    def __init__(self):
+    """ An index of task-tokens; tasks grouped by token value. It also keeps track of the values each task is
+        indexed with.
+
+        :param values: Values whose entries are created in advance.
+    """
+    def __init__(self, values=()):
         super().__init__(WeakSet)
+        self.update((x, WeakSet()) for x in values)
+        self._values_by_task = WeakKeyDictionary()
+
+    def add(self, value, task):
+        """ Adds a task to the tasks of a value. """
+        self[value].add(task)
+        self._values_by_task.setdefault(task, set()).add(value)
+
+    def discard(self, value, task):
+        """ Removes a task from the tasks of a value. """
+        tasks = self.get(value)
+        if tasks is not None:
+            tasks.discard(task)
+        values = self._values_by_task.get(task)
+        if values is not None:
+            values.discard(value)
+
+    def values_of(self, task):
+        """ Returns the values a task is indexed with. """
+        return self._values_by_task.get(task, ())
 
     def _discard(self, task):
-        for indexed_tasks in self.values():
-            indexed_tasks.discard(task)
+        """ Removes a task from the tasks of all values it is indexed with. """
+        for value in self._values_by_task.pop(task, ()):
+            tasks = self.get(value)
+            if tasks is not None:
+                tasks.discard(task)
 
 
 class BaseIndexedToken(BaseToken, metaclass=_RegisterLeafClassesWithIndex):
     """ Base class for tokens that keep track of their associated tasks. """
+    __slots__ = ()
 
     index = None
     """ The index of all known values and the tasks they are used in. """
+    task_attribute = None
+    """ The name of the :class:`Task`-property that returns this type's token(s) or :obj:`None`. """
 
     def __init__(self, value=None, task=None):
         super().__init__(value, task)
+        self._add_to_index()
+
+    def _add_to_index(self):
         if self.task:
-            if self.is_singleton:
-                self.index._discard(task)
-            self.index[self.value].add(self.task)
+            # a task is indexed with the first parsed singleton of a type, the one that the task's property returns
+            if self.is_singleton and self.index.values_of(self.task):
+                return
+            self.index.add(self.value, self.task)
+
+    @classmethod
+    def _from_value(cls, value, task):
+        token = super()._from_value(value, task)
+        token._add_to_index()
+        return token
+
+    @BaseToken.value.setter
+    def value(self, value):
+        former = getattr(self, '_value', None)
+        BaseToken.value.fset(self, value)
+        task = getattr(self, 'task', None)
+        if task is None:
+            return
+        if self.is_singleton:
+            # a task is indexed with the singleton that the task's property returns
+            if self.task_attribute is not None and getattr(task, self.task_attribute) is not self:
+                return
+        elif any(type(x) is type(self) and x is not self and x.value == former for x in task.tokens):
+            # a task stays indexed with a value that another of its tokens still holds
+            self.index.add(value, task)
+            return
+        self.index.discard(former, task)
+        self.index.add(value, task)
 
 
 class BaseDateToken(BaseIndexedToken):
     """ Base class for tokens that represent some date. """
+    __slots__ = ()
+
     is_singleton = True
-    parse_pattern = re.compile(r'^(?P<value>\d{4}-\d{2}-\d{2})$')
+    parse_pattern = re.compile(r'^(?P<value>[0-9]{4}-[0-9]{2}-[0-9]{2})$')
     type = (datetime.date, str)
 
     def __init__(self, value=None, task=None):
@@ -694,59 +1092,101 @@ class BaseDateToken(BaseIndexedToken):
             value = value.value
         super().__init__(value, task)
 
+    @classmethod
+    def _cast(cls, value):
+        return datetime.date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+
     @classmethod
     def _duck(cls, value):
         if isinstance(value, str):
-            if cls.parse_pattern.match(value):
-                value = cls.parse_pattern.match(value).group('value')
-            elif not BaseDateToken.parse_pattern.match(value):
+            match = _date_token_pattern.match(value)
+            if match is None:
+                match = cls.parse_pattern.match(value)
+                if match is None:
+                    raise ValueError
+            elif match.group('prefix') and not issubclass(cls, _prefixed_date_token_types[match.group('prefix')]):
                 raise ValueError
-            value = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+            value = _cached_cast(cls, match.group('value'))
         return value
 
     @property
     def name(self):
-        return '{:04d}-{:02d}-{:02d}'.format(self.value.year, self.value.month, self.value.day)
+        return datetime.date.isoformat(self.value)
 
 
 class TaskCompletedDate(BaseDateToken):
     """ A token that represents the date when a task was marked as completed. """
+    __slots__ = ()
+
     fixed_pos = 1
     html_pattern = '<span class="completeddate">{name}</span>'
     str_pattern = '{name}'
+    task_attribute = 'completion_date'
 
 
 class TaskContext(BaseIndexedToken):
     """ A token that represents one task's context. """
+    __slots__ = ()
+
     html_pattern = '<span class="context">@{name}</span>'
     parse_pattern = r'^@(?P<value>\S+)$'
     str_pattern = '@{name}'
+    task_attribute = 'contexts'
     type = str
 
 
 class TaskCreatedDate(BaseDateToken):
     """ A token that represents the date when a task was created. """
+    __slots__ = ()
+
     fixed_pos = 3
     html_pattern = '<span class="createddate">{name}</span>'
     str_pattern = '{name}'
+    task_attribute = 'created_date'
 
 
 class TaskDueDate(BaseDateToken):
     """ A token that represents a task's due date. """
+    __slots__ = ()
+
     html_pattern = '<span class="duedate">due:{name}</span>'
-    parse_pattern = r'^due:(?P<value>\d{4}-\d{2}-\d{2})$'
+    parse_pattern = r'^due:(?P<value>[0-9]{4}-[0-9]{2}-[0-9]{2})$'
     str_pattern = 'due:{name}'
+    task_attribute = 'due_date'
+
+
+_priority_values = {x: i for i, x in enumerate(ascii_uppercase, start=1)}
+_priority_values.update({x.lower(): i for x, i in _priority_values.items()})
+_priority_names = (' ',) + tuple(ascii_uppercase)
+
+
+def _priority_from_string(string):
+    """ Converts a letter, optionally surrounded by brackets, to a priority value; other characters result in -1. """
+    match = TaskPriority.parse_pattern.match(string)
+    if match:
+        string = match.group('value')
+    if len(string) != 1:
+        raise ValueError('String must be one character long. It may be surrounded by a pair of brackets.')
+    return _priority_values.get(string, -1)
 
 
 class TaskPriority(BaseIndexedToken):
     """ A token that represents a task's priority. """
+    __slots__ = ()
+
     fixed_pos = 2
     html_pattern = '<span class="priority">{name}</span>'
+    index = TokenIndex(range(27))
     is_singleton = True
     parse_pattern = r'^\((?P<value>[A-Z])\)$'
     str_pattern = '({name})'
+    task_attribute = 'priority'
     type = (str, int)
 
+    @classmethod
+    def _cast(cls, value):
+        return _priority_values.get(value, -1)
+
     @classmethod
     def _duck(cls, value):
         if value is None:
@@ -754,12 +1194,7 @@ class TaskPriority(BaseIndexedToken):
         elif isinstance(value, TaskPriority):
             value = value.value
         elif isinstance(value, str):
-            if cls.parse_pattern.match(value):
-                value = cls.parse_pattern.match(value).group('value')
-            if len(value.upper()) != 1:
-                raise ValueError('String must be one character long. It may be surrounded by a pair of brackets.')
-            else:
-                value = ord(value.upper()) - 64
+            value = _priority_from_string(value)
         if not 0 <= value <= 26:
             raise ValueError('Expecting an int [0-26] or string [A-Z ].')
         return value
@@ -809,13 +1244,11 @@ class TaskPriority(BaseIndexedToken):
     def html(self):
         if not self.value:
             return ''
-        return self.html_pattern.format(name=self.name)
+        return super().html
 
     @property
     def name(self):
-        if not self.value:
-            return ' '
-        return chr(self.value + 64)
+        return _priority_names[self.value]
 
     def __str__(self):
         if not self.value:
@@ -825,14 +1258,19 @@ class TaskPriority(BaseIndexedToken):
 
 class TaskProject(BaseIndexedToken):
     """ A token that represents one task's project. """
+    __slots__ = ()
+
     html_pattern = '<span class="project">+{name}</span>'
     parse_pattern = r'^\+(?P<value>\S+)$'
     str_pattern = '+{name}'
+    task_attribute = 'projects'
     type = str
 
 
 class TaskString(str):
     """ A plain sequence of characters. """
+    __slots__ = ()
+
     is_singleton = False
 
     @property
@@ -845,29 +1283,38 @@ class TaskString(str):
 
 
 token_types.add(TaskString)
+_token_types_tuple = tuple(token_types)
 
 
 class TaskThresholdDate(BaseDateToken):
     """ A token that represents a task's threshold date. """
+    __slots__ = ()
+
     html_pattern = '<span class="thresholddate">t:{name}</span>'
-    parse_pattern = r'^t:(?P<value>\d{4}-\d{2}-\d{2})$'
+    parse_pattern = r'^t:(?P<value>[0-9]{4}-[0-9]{2}-[0-9]{2})$'
     str_pattern = 't:{name}'
+    task_attribute = 'threshold_date'
+
+
+_date_token_pattern = re.compile(r'^(?:(?P<prefix>due|t):)?(?P<value>[0-9]{4}-[0-9]{2}-[0-9]{2})$')
+_prefixed_date_token_types = {'due': TaskDueDate, 't': TaskThresholdDate}
 
 
 class Url(BaseToken):
     """ A token that represents an URL. """
+    __slots__ = ()
+
     html_pattern = '<a href="{name}">{name}</a>'
     parse_pattern = re.compile(
         r'^(?P<value>'  # noqa
-            r'((https?|ftp)://'  # http(s)- or ftp-scheme
+            r'((?i:https?|ftp)://'  # http(s)- or ftp-scheme
                 r'(\S+(:\S+)?@)?'  # optional user:password@
-                    r'(([A-Z0-9]([A-Z0-9-]{0,61}[A-Z0-9])\.?)+|'  # hostname ...
+                    r'(([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])\.?)+|'  # hostname ...
                     r'(\d{1,3}\.){3}\d{1,3}|'  # ...or ipv4
-                    r'\[?[A-F0-9]*:[A-F0-9:]+\]?)'  # ...or ipv6
+                    r'\[?[A-Fa-f0-9]*:[A-Fa-f0-9:]+\]?)'  # ...or ipv6
                 r'(:\d{1,5})?'  # optional port
                 r'(/?|[/?]\S+)|'  # (no) trailing slash and anything in the path
-            r'file:///.*)'  # ..or sleazy file-scheme
-        r')$',  # the end
-        re.IGNORECASE)
+            r'(?i:file):///.*)'  # ..or sleazy file-scheme
+        r')$')  # the end
     str_pattern = '{name}'
     type = str